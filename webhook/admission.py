@@ -0,0 +1,294 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+# Tier used for requests we can't tie to a known user
+DEFAULT_TIER = "Free"
+DEFAULT_RATE_LIMIT_HOURLY = 100
+
+# Burst allowance per tier (tokens); refill comes from the user's rate_limit_hourly
+TIER_BURST = {"Free": 5, "Pro": 20, "Enterprise": 50}
+
+# Weighted fair queuing: share of RAG capacity per tenant under contention
+TIER_WEIGHTS = {"Free": 1, "Pro": 4, "Enterprise": 8}
+
+MAX_CONCURRENT_RAG = 4       # RAG searches allowed to run at once
+QUEUE_TIMEOUT_SECONDS = 10.0  # Give up waiting for a RAG slot after this long
+MAX_TRACKED_TENANTS = 10000   # Sessions/buckets remembered, LRU-bounded
+WAIT_SAMPLES = 1000           # Recent queue waits kept per tier for percentiles
+
+
+class QueueTimeout(Exception):
+    """Raised when a request waited too long for a RAG slot."""
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` burst, refilled at `rate` tokens/second."""
+
+    __slots__ = ("capacity", "rate", "tokens", "updated")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+
+class _Waiter:
+    __slots__ = ("start_tag", "event", "granted", "cancelled")
+
+    def __init__(self, start_tag: float):
+        self.start_tag = start_tag
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of RAG work across tenants.
+
+    At most `max_concurrent` searches run at once. When all slots are busy,
+    waiting requests are served in order of their virtual finish time, so a
+    tenant flooding the queue only delays its own later requests, and
+    higher-weight tenants get proportionally more slots.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RAG,
+                 queue_timeout: float = QUEUE_TIMEOUT_SECONDS):
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        self._queue = []  # heap of (finish_tag, seq, waiter)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}  # tenant -> finish tag of its latest request
+
+    @contextmanager
+    def slot(self, tenant: str, weight: float):
+        """
+        Hold a RAG slot for the duration of the block.
+
+        Yields the seconds spent queued. Raises QueueTimeout if no slot
+        frees up within queue_timeout.
+        """
+        waited = self._acquire(tenant, weight)
+        try:
+            yield waited
+        finally:
+            self._release()
+
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(1 for _, _, waiter in self._queue if not waiter.cancelled)
+
+    def _acquire(self, tenant: str, weight: float) -> float:
+        with self._lock:
+            start_tag = max(self._virtual_time, self._last_finish.get(tenant, 0.0))
+            self._last_finish[tenant] = start_tag + 1.0 / weight
+
+            if self._active < self.max_concurrent and not self._queue:
+                self._active += 1
+                self._virtual_time = start_tag
+                return 0.0
+
+            waiter = _Waiter(start_tag)
+            heapq.heappush(self._queue, (self._last_finish[tenant], next(self._seq), waiter))
+
+        enqueued_at = time.monotonic()
+        if not waiter.event.wait(self.queue_timeout):
+            with self._lock:
+                # A slot may have been handed over just as we timed out
+                if not waiter.granted:
+                    waiter.cancelled = True
+                    raise QueueTimeout(f"No RAG slot for {tenant} after {self.queue_timeout}s")
+        return time.monotonic() - enqueued_at
+
+    def _release(self):
+        with self._lock:
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.cancelled:
+                    continue
+                # Hand the slot straight to the next waiter; _active is unchanged
+                waiter.granted = True
+                self._virtual_time = waiter.start_tag
+                waiter.event.set()
+                return
+
+            self._active -= 1
+            if len(self._last_finish) > MAX_TRACKED_TENANTS:
+                # Tenants whose tags are behind virtual time no longer matter
+                self._last_finish = {
+                    tenant: finish for tenant, finish in self._last_finish.items()
+                    if finish > self._virtual_time
+                }
+
+
+class AdmissionController:
+    """
+    Per-tenant admission control using subscription tiers from users.json.
+
+    - Token bucket per tenant (Dialogflow session, else client address)
+      sized from the tier's burst and the session user's rate_limit_hourly
+    - Weighted fair queuing of RAG work so Enterprise and Pro traffic keeps
+      its latency when a Free tenant floods general_knowledge
+
+    LLMOps Practice: Per-tier admitted/throttled counts and queue wait metrics
+    """
+
+    def __init__(self, user_lookup: Callable[[str], Optional[Dict]],
+                 scheduler: Optional[FairScheduler] = None):
+        """
+        Args:
+            user_lookup: email -> user dict (with subscription_tier and
+                rate_limit_hourly), or None if unknown
+        """
+        self.user_lookup = user_lookup
+        self.scheduler = scheduler or FairScheduler()
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+        self._session_emails = OrderedDict()
+        self._stats = {}
+
+    def identify(self, email: Optional[str], session: Optional[str],
+                 client: Optional[str] = None) -> Tuple[str, str, int]:
+        """
+        Work out who a request belongs to.
+
+        The tenant is always the Dialogflow session (or, for requests without
+        one, the client address), never the email, so typing a customer's
+        email can't spend that customer's tokens. A session is tied to the
+        first known user whose email is given on it and keeps that user's
+        tier for follow-up questions; a different email later in the same
+        session doesn't change it. Requests without a session stay on the
+        default tier.
+
+        Returns:
+            (tenant key, subscription tier, hourly rate limit)
+        """
+        if not session:
+            return f"client:{client or 'anonymous'}", DEFAULT_TIER, DEFAULT_RATE_LIMIT_HOURLY
+
+        tenant = f"session:{session}"
+        with self._lock:
+            bound = self._session_emails.get(session)
+            if bound:
+                self._session_emails.move_to_end(session)
+
+        if bound is None and email:
+            email = email.lower().strip()
+            if self.user_lookup(email):
+                with self._lock:
+                    # setdefault: a concurrent request may have tied the session first
+                    bound = self._session_emails.setdefault(session, email)
+                    if len(self._session_emails) > MAX_TRACKED_TENANTS:
+                        self._session_emails.popitem(last=False)
+
+        user = self.user_lookup(bound) if bound else None
+        if user:
+            return tenant, user['subscription_tier'], user['rate_limit_hourly']
+        return tenant, DEFAULT_TIER, DEFAULT_RATE_LIMIT_HOURLY
+
+    def admit(self, tenant: str, tier: str, rate_limit_hourly: int, tokens: int = 1) -> bool:
+        """
+        Take `tokens` tokens (one per query) from the tenant's bucket.
+
+        All or nothing; False means throttle.
+        """
+        with self._lock:
+            capacity = TIER_BURST.get(tier, TIER_BURST[DEFAULT_TIER])
+            rate = rate_limit_hourly / 3600.0
+            bucket = self._buckets.get(tenant)
+            if bucket is None:
+                bucket = self._buckets[tenant] = TokenBucket(capacity, rate)
+                if len(self._buckets) > MAX_TRACKED_TENANTS:
+                    self._buckets.popitem(last=False)
+            else:
+                # The session may have been tied to a user since the bucket was made
+                bucket.capacity, bucket.rate = capacity, rate
+            self._buckets.move_to_end(tenant)
+            admitted = bucket.try_acquire(tokens)
+
+            stats = self._tier_stats(tier)
+            stats["admitted" if admitted else "throttled"] += tokens
+        return admitted
+
+    @staticmethod
+    def max_batch_queries(tier: str) -> int:
+        """Largest batch a tier can be charged for: batches pay per query, up front."""
+        return TIER_BURST.get(tier, TIER_BURST[DEFAULT_TIER])
+
+    @contextmanager
+    def rag_slot(self, tenant: str, tier: str):
+        """Wait for a fairly-scheduled RAG slot, recording queue wait per tier."""
+        weight = TIER_WEIGHTS.get(tier, TIER_WEIGHTS[DEFAULT_TIER])
+        try:
+            with self.scheduler.slot(tenant, weight) as waited:
+                self._record_wait(tier, waited)
+                yield waited
+        except QueueTimeout:
+            self._record_wait(tier, self.scheduler.queue_timeout, timed_out=True)
+            raise
+
+    def _tier_stats(self, tier: str) -> Dict:
+        # Caller holds self._lock
+        if tier not in self._stats:
+            self._stats[tier] = {
+                "admitted": 0,
+                "throttled": 0,
+                "queue_timeouts": 0,
+                "queued_requests": 0,
+                "queue_wait_total_ms": 0.0,
+                "queue_wait_max_ms": 0.0,
+                "recent_waits_ms": deque(maxlen=WAIT_SAMPLES),
+            }
+        return self._stats[tier]
+
+    def _record_wait(self, tier: str, waited: float, timed_out: bool = False):
+        waited_ms = waited * 1000
+        with self._lock:
+            stats = self._tier_stats(tier)
+            stats["queued_requests"] += 1
+            stats["queue_wait_total_ms"] += waited_ms
+            stats["queue_wait_max_ms"] = max(stats["queue_wait_max_ms"], waited_ms)
+            stats["recent_waits_ms"].append(waited_ms)
+            if timed_out:
+                stats["queue_timeouts"] += 1
+
+    def get_stats(self) -> Dict:
+        """Per-tier admission counts and RAG queue wait (avg/p50/p95/max ms)."""
+        with self._lock:
+            tiers = {}
+            for tier, stats in self._stats.items():
+                waits = sorted(stats["recent_waits_ms"])
+                queued = stats["queued_requests"]
+                tiers[tier] = {
+                    "admitted": stats["admitted"],
+                    "throttled": stats["throttled"],
+                    "queue_timeouts": stats["queue_timeouts"],
+                    "queued_requests": queued,
+                    "queue_wait_avg_ms": round(stats["queue_wait_total_ms"] / queued, 2) if queued else 0,
+                    "queue_wait_p50_ms": round(waits[len(waits) // 2], 2) if waits else 0,
+                    "queue_wait_p95_ms": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 2) if waits else 0,
+                    "queue_wait_max_ms": round(stats["queue_wait_max_ms"], 2),
+                }
+        return {
+            "tiers": tiers,
+            "rag_queue_depth": self.scheduler.queue_depth(),
+            "max_concurrent_rag": self.scheduler.max_concurrent,
+        }
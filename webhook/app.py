@@ -1,20 +1,34 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
 import json
 import os
+import re
 import time
 from datetime import datetime
 from rag_engine import get_rag_engine
 from monitoring import get_query_logger
+from intent_router import get_intent_classifier, reroute_intent
+from admission import AdmissionController, QueueTimeout
+from profiler import RequestProfiler
 
 
 app = Flask(__name__)
 
+# Opt-in latency profiling: PROFILING=1 enables the X-Profile header,
+# PROFILE_SAMPLE_RATE profiles a random fraction of requests
+profiler = RequestProfiler.from_env()
+profiler.init_app(app)
+
 # Initialize RAG engine once at startup
 
 print("Initializing RAG engine...")
 rag_engine = get_rag_engine()
 print("RAG engine ready!")
 
+# Local intent classifier trained from the Dialogflow agent export
+intent_classifier = get_intent_classifier()
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+
 
 # Load user data
 def load_users():
@@ -34,6 +48,17 @@ def find_user_by_email(email):
             return user
     return None
 
+# Per-tenant rate limiting and fair scheduling of RAG work by subscription tier
+admission = AdmissionController(user_lookup=find_user_by_email)
+
+THROTTLED_RESPONSE = """You're sending messages faster than I can keep up with! Please wait a moment and try again.
+
+Need higher limits? Check out our Pro and Enterprise plans: Settings → Billing → Change Plan"""
+
+BUSY_RESPONSE = """I'm handling a lot of questions right now and couldn't search our documentation in time. Please try again in a moment.
+
+📚 You can also browse the docs directly: https://docs.yourcompany.com"""
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
     """Main webhook endpoint for Dialogflow"""
@@ -44,23 +69,40 @@ def webhook():
     intent_name = req.get('queryResult').get('intent').get('displayName')
     parameters = req.get('queryResult').get('parameters', {})
     query_text = req.get('queryResult').get('queryText', '')
+    confidence = req.get('queryResult').get('intentDetectionConfidence')
+
+    # Send misrouted account questions to the cheap handlers instead of RAG
+    rerouted = reroute_intent(intent_classifier, intent_name, query_text, confidence)
+    if rerouted:
+        print(f"Re-routing {intent_name} -> {rerouted}")
+        intent_name = rerouted
+        parameters = dict(parameters)
+        if not parameters.get('email'):
+            email_match = EMAIL_PATTERN.search(query_text)
+            if email_match:
+                parameters['email'] = email_match.group(0)
 
     
     # LLMOps: Log incoming requests for monitoring
     print(f"Intent: {intent_name}")
     print(f"Parameters: {parameters}")
+
+    # Admission control: token bucket per session, sized by the session user's tier
+    g.tenant, g.tier, rate_limit_hourly = admission.identify(
+        parameters.get('email'), req.get('session'), request.remote_addr
+    )
+    admitted = admission.admit(g.tenant, g.tier, rate_limit_hourly)
     
     # Route to appropriate handler
-    if intent_name == 'api_authentication':
-        response_text = handle_api_authentication(parameters)
-    elif intent_name == 'api_rate_limits':
-        response_text = handle_api_rate_limits(parameters)
-    elif intent_name == 'billing_question':
-        response_text = handle_billing_question(parameters)
-    elif intent_name == 'general_knowledge':  # NEW: RAG-powered intent
-        response_text = handle_general_knowledge(parameters)
+    handler = INTENT_HANDLERS.get(intent_name)
+    if not admitted:
+        print(f"Throttled {g.tenant} ({g.tier})")
+        response_text = THROTTLED_RESPONSE
+        intent_name = 'throttled'
+    elif handler:
+        response_text = handler(parameters)
     else:
-        response_text = "I can help with API authentication, rate limits, billing questions, or general documentation questions."
+        response_text = "I can help with API authentication, rate limits, billing questions, password resets, integrations, or general documentation questions."
     
      # Log query for monitoring (LLMOps practice)
     response_time = time.time() - start_time
@@ -97,7 +139,9 @@ What would you like to know?"""
     # Use RAG to search knowledge base
     # Software Engineering: Error handling for production reliability
     try:
-        result = rag_engine.search(query)
+        # Weighted fair queuing so one tenant can't starve the others
+        with admission.rag_slot(g.get('tenant', 'client:anonymous'), g.get('tier', 'Free')):
+            result = rag_engine.search(query)
         
         answer = result['answer']
         sources = result['sources']
@@ -109,7 +153,8 @@ What would you like to know?"""
             query=query,
             intent="general_knowledge",
             response_time=response_time,
-            sources=sources
+            sources=sources,
+            route=result.get('route')
         )
 
         # Format response with sources
@@ -121,6 +166,10 @@ What would you like to know?"""
             response += f"📚 Sources: {', '.join(source_names)}"
         
         return response
+
+    except QueueTimeout as e:
+        print(f"RAG queue timeout: {str(e)}")
+        return BUSY_RESPONSE
         
     except Exception as e:
         # Software Engineering: Graceful error handling
@@ -237,6 +286,151 @@ Need help with billing? I can connect you with our billing team."""
     
     return response
 
+def handle_password_reset(parameters):
+    """Handle password reset queries."""
+    return """No problem! I can help you reset your password.
+
+To reset your password:
+1. Go to https://app.yourcompany.com/reset-password
+2. Enter your email address
+3. Check your inbox (and spam folder) for the reset link
+4. The link expires in 24 hours
+
+You should receive the email within 2-3 minutes.
+
+Did you receive the reset email?"""
+
+def handle_integration_help(parameters):
+    """Handle integration setup queries."""
+    return """I can help you set up integrations!
+
+Popular integrations:
+- Slack: Settings → Integrations → Slack (requires admin permissions)
+- Salesforce: Settings → Integrations → Salesforce
+- Zapier: Use our Zapier app (search "YourApp" in Zapier)
+- Webhooks: Settings → Developers → Webhooks
+
+📚 Full integration docs: https://docs.yourcompany.com/integrations
+
+Which integration are you working with?"""
+
+# Intent displayName -> handler
+# Software Engineering: Registry instead of an if/elif chain; add intents here
+INTENT_HANDLERS = {
+    'api_authentication': handle_api_authentication,
+    'api_rate_limit': handle_api_rate_limits,
+    'api_rate_limits': handle_api_rate_limits,  # Legacy name used by older agent versions
+    'billing_question': handle_billing_question,
+    'password_reset': handle_password_reset,
+    'integration_help': handle_integration_help,
+    'general_knowledge': handle_general_knowledge,  # RAG-powered intent
+}
+
+# Upper bound on concurrent LLM calls a single batch request may use
+MAX_BATCH_WORKERS = 16
+
+@app.route('/batch/search', methods=['POST'])
+def batch_search():
+    """
+    Bulk question answering over the knowledge base.
+
+    Body: {"queries": [str | {"id": ..., "query": str}, ...],
+           "skip_ids": [...], "max_workers": int, "batch_size": int,
+           "session": str}
+
+    Streams one JSON object per line (application/x-ndjson) as each answer
+    completes. Pass the ids you already have as skip_ids to resume.
+
+    Every query to answer costs one token from the session's (or client
+    address's) bucket, paid up front, the same as one webhook message, and
+    a batch can't be larger than the tier's burst. Each generation then
+    waits for a fairly-scheduled RAG slot, so batches share capacity with
+    interactive traffic.
+    """
+    req = request.get_json(force=True, silent=True)
+    if not isinstance(req, dict):
+        return jsonify({'error': 'body must be a JSON object'}), 400
+    queries = req.get('queries', [])
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'queries must be a non-empty list'}), 400
+
+    try:
+        max_workers = int(req.get('max_workers', 8))
+        batch_size = int(req.get('batch_size', 64))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_workers and batch_size must be integers'}), 400
+    if max_workers < 1 or batch_size < 1:
+        return jsonify({'error': 'max_workers and batch_size must be positive'}), 400
+    max_workers = min(max_workers, MAX_BATCH_WORKERS)
+
+    skip_ids = req.get('skip_ids', [])
+    if not isinstance(skip_ids, list):
+        return jsonify({'error': 'skip_ids must be a list'}), 400
+
+    session = req.get('session')
+    tenant, tier, rate_limit_hourly = admission.identify(
+        None, session if isinstance(session, str) else None, request.remote_addr
+    )
+
+    # Charge for the queries this request will actually answer
+    skipped = {i for i in skip_ids if isinstance(i, (str, int))}
+    to_answer = sum(
+        1 for position, item in enumerate(queries)
+        if not _batch_item_skipped(position, item, skipped)
+    )
+    max_queries = admission.max_batch_queries(tier)
+    if to_answer > max_queries:
+        return jsonify({
+            'error': f'{tier} tier batches are limited to {max_queries} queries; split the batch'
+        }), 413
+    if not admission.admit(tenant, tier, rate_limit_hourly, tokens=to_answer):
+        return jsonify({'error': 'rate limit exceeded, try again later'}), 429
+
+    def results():
+        for result in rag_engine.search_batch(
+            queries,
+            batch_size=batch_size,
+            max_workers=max_workers,
+            skip_ids=skip_ids,
+            slot=lambda: admission.rag_slot(tenant, tier)
+        ):
+            yield json.dumps(result) + "\n"
+
+    return Response(stream_with_context(results()), mimetype='application/x-ndjson')
+
+def _batch_item_skipped(position, item, skipped):
+    item_id = item.get('id', position) if isinstance(item, dict) else position
+    return isinstance(item_id, (str, int)) and item_id in skipped
+
+@app.route('/router/stats', methods=['GET'])
+def router_stats():
+    """Per-route request count, latency and estimated cost for RAG generation"""
+    return jsonify(rag_engine.router.get_stats())
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Query embedding cache hit rate and SQLite errors"""
+    return jsonify(rag_engine.query_embeddings.cache.get_stats())
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """Per-tier admitted/throttled counts and RAG queue wait times"""
+    return jsonify(admission.get_stats())
+
+@app.route('/profiles/slowest', methods=['GET'])
+def profiles_slowest():
+    """Slowest profiled requests with the functions they spent the most time in"""
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify({'profiles': profiler.slowest(limit)})
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def profile_download(profile_id):
+    """Download a profile (?format=speedscope|collapsed)"""
+    path = profiler.profile_path(profile_id, request.args.get('format', 'speedscope'))
+    if path is None:
+        return jsonify({'error': 'profile not found'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True)
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
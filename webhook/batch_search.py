@@ -0,0 +1,96 @@
+"""
+Bulk question answering over a backlog of tickets.
+
+Usage:
+    python batch_search.py tickets.jsonl answers.jsonl [--workers 8] [--batch-size 64]
+
+Input is JSONL, one {"id": ..., "query": "..."} object per line (a bare
+JSON string is also accepted; its line number becomes the id). Results are
+appended to the output file as they complete, so an interrupted run can be
+re-started with the same arguments and will skip tickets already answered.
+Failed items are retried on the next run.
+"""
+import argparse
+import json
+import os
+from rag_engine import get_rag_engine
+
+
+def read_tickets(input_path):
+    """
+    Yield {"id", "query"} dicts from a JSONL file.
+
+    Malformed lines are passed on with a null query so they are reported
+    as failed results instead of stopping the run.
+    """
+    with open(input_path, 'r') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError:
+                print(f"Line {line_number}: invalid JSON")
+                yield {"id": line_number, "query": None}
+                continue
+            if isinstance(item, str):
+                item = {"query": item}
+            if not isinstance(item, dict):
+                yield {"id": line_number, "query": None}
+                continue
+            item.setdefault("id", line_number)
+            yield item
+
+
+def completed_ids(output_path):
+    """Ids already answered successfully in a previous run."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # Partial last line from an interrupted run
+            if result.get("error") is None:
+                done.add(result["id"])
+    return done
+
+
+def run_batch(input_path, output_path, max_workers=8, batch_size=64):
+    """
+    Answer every ticket in input_path, appending results to output_path.
+
+    Returns:
+        dict with counts of answered, failed and skipped tickets
+    """
+    rag_engine = get_rag_engine()
+    skip_ids = completed_ids(output_path)
+    stats = {"answered": 0, "failed": 0, "skipped": len(skip_ids)}
+
+    with open(output_path, 'a') as out:
+        for result in rag_engine.search_batch(
+            read_tickets(input_path),
+            batch_size=batch_size,
+            max_workers=max_workers,
+            skip_ids=skip_ids
+        ):
+            out.write(json.dumps(result) + "\n")
+            out.flush()  # Keep progress durable for resume
+            stats["failed" if result["error"] else "answered"] += 1
+
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a JSONL backlog of support questions with RAG.")
+    parser.add_argument("input", help="JSONL file of {\"id\", \"query\"} objects")
+    parser.add_argument("output", help="JSONL file to append results to")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent LLM calls")
+    parser.add_argument("--batch-size", type=int, default=64, help="Queries per embedding call")
+    args = parser.parse_args()
+
+    stats = run_batch(args.input, args.output, max_workers=args.workers, batch_size=args.batch_size)
+    print(f"Answered {stats['answered']}, failed {stats['failed']}, skipped {stats['skipped']} already done")
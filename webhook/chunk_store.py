@@ -0,0 +1,175 @@
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional
+
+
+class ChunkRecord:
+    """
+    Lightweight view of one chunk in a ChunkStore.
+
+    Software Engineering: __slots__ keeps each record to a few machine words;
+    text is only decoded when asked for.
+    """
+
+    __slots__ = ("store", "index")
+
+    def __init__(self, store: "ChunkStore", index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def text(self) -> str:
+        return self.store.text(self.index)
+
+    @property
+    def source(self) -> str:
+        return self.store.source(self.index)
+
+    @property
+    def metadata(self) -> Dict:
+        return self.store.metadata(self.index)
+
+    def to_document(self):
+        """Materialize a LangChain Document for this chunk."""
+        from langchain_core.documents import Document
+        return Document(page_content=self.text, metadata=self.metadata)
+
+    def __repr__(self):
+        return f"ChunkRecord(index={self.index}, source={self.source!r})"
+
+
+class ChunkStore:
+    """
+    Compact in-memory store for knowledge base chunks.
+
+    Replaces a list of LangChain Documents (one Python str and one metadata
+    dict per chunk) with:
+    - all chunk texts UTF-8 encoded into one contiguous bytes buffer
+    - an array of offsets into that buffer
+    - interned source paths, referenced by a small integer per chunk
+    - extra metadata kept sparsely, only for chunks that have any
+
+    Documents are materialized on demand, e.g. for the top-k results of a
+    query.
+    """
+
+    __slots__ = ("_buffer", "_offsets", "_source_ids", "_sources", "_extra")
+
+    def __init__(self, buffer: bytes, offsets: array, source_ids: array,
+                 sources: List[str], extra: Optional[Dict[int, Dict]] = None):
+        self._buffer = buffer
+        self._offsets = offsets        # len(chunks) + 1 boundaries
+        self._source_ids = source_ids
+        self._sources = sources
+        self._extra = extra or {}
+
+    @classmethod
+    def from_documents(cls, documents: Iterable) -> "ChunkStore":
+        """Build a store from LangChain Documents (or anything with page_content/metadata)."""
+        parts = []
+        offsets = array("Q", [0])
+        source_ids = array("I")
+        sources = []
+        source_index = {}
+        extra = {}
+
+        for i, doc in enumerate(documents):
+            encoded = doc.page_content.encode("utf-8")
+            parts.append(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+
+            metadata = dict(doc.metadata)
+            source = metadata.pop("source", "Unknown")
+            if source not in source_index:
+                source_index[source] = len(sources)
+                sources.append(sys.intern(source))
+            source_ids.append(source_index[source])
+
+            if metadata:
+                extra[i] = metadata
+
+        return cls(b"".join(parts), offsets, source_ids, sources, extra)
+
+    def __len__(self) -> int:
+        return len(self._source_ids)
+
+    def __getitem__(self, index: int) -> ChunkRecord:
+        if not 0 <= index < len(self):
+            raise IndexError(f"chunk index out of range: {index}")
+        return ChunkRecord(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield ChunkRecord(self, i)
+
+    def text(self, index: int) -> str:
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return self._buffer[start:end].decode("utf-8")
+
+    def source(self, index: int) -> str:
+        return self._sources[self._source_ids[index]]
+
+    def metadata(self, index: int) -> Dict:
+        metadata = {"source": self.source(index)}
+        metadata.update(self._extra.get(index, {}))
+        return metadata
+
+    def texts(self) -> List[str]:
+        """All chunk texts (for ingestion into the vector store)."""
+        return [self.text(i) for i in range(len(self))]
+
+    def metadatas(self) -> List[Dict]:
+        """All chunk metadata dicts (for ingestion into the vector store)."""
+        return [self.metadata(i) for i in range(len(self))]
+
+    def documents(self, indexes: Iterable[int]) -> List:
+        """Materialize Documents for just the given chunk indexes."""
+        return [self[i].to_document() for i in indexes]
+
+    def nbytes(self) -> int:
+        """Approximate memory held by the store's buffers."""
+        return (
+            len(self._buffer)
+            + self._offsets.itemsize * len(self._offsets)
+            + self._source_ids.itemsize * len(self._source_ids)
+            + sum(len(s) for s in self._sources)
+        )
+
+
+# Memory benchmark
+if __name__ == "__main__":
+    # Compare resident memory of 10k chunks as Documents vs a ChunkStore
+    import gc
+    import random
+    import tracemalloc
+    from langchain_core.documents import Document
+
+    NUM_CHUNKS = 10_000
+    random.seed(0)
+    words = ["api", "webhook", "billing", "invoice", "rate", "limit", "token",
+             "integration", "slack", "salesforce", "subscription", "request"]
+
+    def make_documents():
+        return [
+            Document(
+                page_content=" ".join(random.choice(words) for _ in range(130))[:1000],
+                metadata={"source": f"knowledge_base/doc_{i % 50}.md"}
+            )
+            for i in range(NUM_CHUNKS)
+        ]
+
+    def measure(build):
+        gc.collect()
+        tracemalloc.start()
+        obj = build()
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return obj, current
+
+    documents, documents_bytes = measure(make_documents)
+    store, store_bytes = measure(lambda: ChunkStore.from_documents(documents))
+
+    print(f"{NUM_CHUNKS} chunks as Documents: {documents_bytes / 1024 / 1024:.2f} MiB")
+    print(f"{NUM_CHUNKS} chunks in ChunkStore: {store_bytes / 1024 / 1024:.2f} MiB")
+    print(f"Reduction: {(1 - store_bytes / documents_bytes) * 100:.1f}%")
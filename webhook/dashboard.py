@@ -1,6 +1,13 @@
-from flask import Flask, render_template_string
-from monitoring import get_query_logger
+from flask import Flask, Response, render_template_string, request, jsonify, stream_with_context
+from monitoring import get_query_logger, ROLLUP_RESOLUTIONS
 import json
+import time
+from datetime import datetime
+
+# How often the SSE stream checks for new rollups, and how often it sends
+# a keepalive comment so proxies don't drop idle connections
+STREAM_POLL_SECONDS = 1.0
+STREAM_KEEPALIVE_SECONDS = 15.0
 
 app = Flask(__name__)
 
@@ -136,11 +143,28 @@ DASHBOARD_HTML = """
         .intent-general { background: #e3f2fd; color: #1976d2; }
         .intent-api { background: #f3e5f5; color: #7b1fa2; }
         .intent-billing { background: #fff3e0; color: #f57c00; }
+        .timeseries-chart {
+            width: 100%;
+            height: 220px;
+        }
+        .chart-legend {
+            display: flex;
+            gap: 20px;
+            font-size: 0.85em;
+            color: #666;
+            margin-top: 10px;
+        }
+        .live-indicator {
+            float: right;
+            font-size: 0.8em;
+            color: #999;
+        }
     </style>
 </head>
 <body>
     <div class="container">
         <div class="header">
+            <span class="live-indicator" id="live-indicator">● connecting…</span>
             <h1>🎯 LLMOps Monitoring Dashboard</h1>
             <p class="subtitle">Real-time monitoring for AI Chatbot with RAG</p>
         </div>
@@ -148,15 +172,19 @@ DASHBOARD_HTML = """
         <div class="metrics-grid">
             <div class="metric-card">
                 <div class="metric-label">Total Queries</div>
-                <div class="metric-value">{{ metrics.total_queries }}</div>
+                <div class="metric-value" id="total-queries">{{ metrics.total_queries }}</div>
             </div>
             <div class="metric-card">
                 <div class="metric-label">Avg Response Time</div>
-                <div class="metric-value">{{ metrics.avg_response_time_ms }}ms</div>
+                <div class="metric-value" id="avg-response-time">{{ metrics.avg_response_time_ms }}ms</div>
+            </div>
+            <div class="metric-card">
+                <div class="metric-label">P95 Response Time (last hour)</div>
+                <div class="metric-value" id="p95-response-time">{{ metrics.p95_response_time_ms }}ms</div>
             </div>
             <div class="metric-card">
                 <div class="metric-label">RAG Queries</div>
-                <div class="metric-value">{{ metrics.total_rag_queries }}</div>
+                <div class="metric-value" id="total-rag-queries">{{ metrics.total_rag_queries }}</div>
             </div>
             <div class="metric-card">
                 <div class="metric-label">Success Rate</div>
@@ -170,6 +198,16 @@ DASHBOARD_HTML = """
             </div>
         </div>
         
+        <div class="chart-section">
+            <h2>📈 Latency &amp; Volume (last 60 minutes)</h2>
+            <svg class="timeseries-chart" id="timeseries-chart" viewBox="0 0 1000 220" preserveAspectRatio="none"></svg>
+            <div class="chart-legend">
+                <span style="color: #667eea;">▮ queries / minute</span>
+                <span style="color: #e53935;">— p95 response time</span>
+                <span id="timeseries-range"></span>
+            </div>
+        </div>
+
         <div class="chart-section">
             <h2>📊 Queries by Intent</h2>
             {% for intent, count in metrics.queries_by_intent.items() %}
@@ -230,18 +268,141 @@ DASHBOARD_HTML = """
             {% endfor %}
         </div>
     </div>
+    <script>
+        // Live updates: the server pushes fresh rollups over SSE instead of
+        // the browser re-rendering the whole page
+        function renderTimeseries(points) {
+            const svg = document.getElementById('timeseries-chart');
+            const width = 1000, height = 200;
+            if (!points.some(p => p.count)) {
+                svg.innerHTML = '<text x="500" y="110" text-anchor="middle" fill="#999">No traffic in the last 60 minutes</text>';
+                return;
+            }
+            const maxCount = Math.max(...points.map(p => p.count), 1);
+            const maxLatency = Math.max(...points.map(p => p.p95_response_time_ms), 1);
+            const step = width / points.length;
+            let bars = '', line = [];
+            points.forEach((p, i) => {
+                const h = (p.count / maxCount) * height;
+                bars += `<rect x="${i * step + 1}" y="${height - h}" width="${Math.max(step - 2, 1)}" height="${h}" fill="#667eea" opacity="0.35"><title>${p.bucket}: ${p.count} queries, p95 ${p.p95_response_time_ms}ms</title></rect>`;
+                line.push(`${i * step + step / 2},${height - (p.p95_response_time_ms / maxLatency) * height}`);
+            });
+            svg.innerHTML = bars + `<polyline points="${line.join(' ')}" fill="none" stroke="#e53935" stroke-width="2"/>`;
+            document.getElementById('timeseries-range').textContent =
+                `${points[0].bucket.replace('T', ' ')} → ${points[points.length - 1].bucket.replace('T', ' ')} (peak p95 ${maxLatency}ms)`;
+        }
+
+        function renderMetrics(metrics) {
+            document.getElementById('total-queries').textContent = metrics.total_queries;
+            document.getElementById('avg-response-time').textContent = metrics.avg_response_time_ms + 'ms';
+            document.getElementById('p95-response-time').textContent = metrics.p95_response_time_ms + 'ms';
+            document.getElementById('total-rag-queries').textContent = metrics.total_rag_queries;
+        }
+
+        const indicator = document.getElementById('live-indicator');
+        const source = new EventSource('/api/stream');
+        source.addEventListener('rollup', (event) => {
+            const data = JSON.parse(event.data);
+            renderMetrics(data.metrics);
+            renderTimeseries(data.timeseries);
+            indicator.textContent = '● live · updated ' + (data.metrics.updated_at || '').split('T').pop().split('.')[0];
+            indicator.style.color = '#43a047';
+        });
+        source.onerror = () => {
+            indicator.textContent = '● reconnecting…';
+            indicator.style.color = '#999';
+        };
+    </script>
 </body>
 </html>
 """
 
+def get_rollup():
+    """Get the shared rollups, picking up any writes from the webhook process"""
+    rollup = get_query_logger().rollup
+    rollup.refresh()
+    return rollup
+
+def conditional_json(payload):
+    """
+    JSON response with an ETag; returns 304 if the client already has it.
+
+    Software Engineering: Lets pollers revalidate for free between updates
+    """
+    response = jsonify(payload)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
 @app.route('/')
 def dashboard():
     """Render monitoring dashboard"""
-    logger = get_query_logger()
-    metrics = logger.get_metrics()
+    # Rendered from pre-aggregated rollups, not a scan of the full query log
+    metrics = get_rollup().summary()
     return render_template_string(DASHBOARD_HTML, metrics=metrics)
 
+@app.route('/api/metrics')
+def api_metrics():
+    """Summary metrics as JSON"""
+    return conditional_json(get_rollup().summary())
+
+@app.route('/api/timeseries')
+def api_timeseries():
+    """
+    Time-series rollups as JSON.
+
+    Query params:
+        resolution: minute | hour | day (default: minute)
+        limit: number of most recent buckets (default: 60)
+        intent: only count queries for this intent
+    """
+    resolution = request.args.get('resolution', 'minute')
+    if resolution not in ROLLUP_RESOLUTIONS:
+        return jsonify({'error': f"resolution must be one of {', '.join(ROLLUP_RESOLUTIONS)}"}), 400
+    limit = request.args.get('limit', 60, type=int)
+    intent = request.args.get('intent')
+
+    return conditional_json({
+        'resolution': resolution,
+        'points': get_rollup().timeseries(resolution, limit=limit, intent=intent)
+    })
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Server-sent events stream of rollup updates.
+
+    Pushes a `rollup` event whenever new queries are logged, so the
+    dashboard stays live without reloading the page.
+    """
+    def events():
+        last_state = None
+        last_sent = time.time()
+        while True:
+            rollup = get_rollup()
+            # Also push when the minute rolls over so the window slides during quiet periods
+            state = (rollup.version, datetime.now().strftime('%Y-%m-%dT%H:%M'))
+            if state != last_state:
+                last_state = state
+                last_version = rollup.version
+                payload = {
+                    'metrics': rollup.summary(),
+                    'timeseries': rollup.timeseries('minute', limit=60)
+                }
+                yield f"event: rollup\nid: {last_version}\ndata: {json.dumps(payload)}\n\n"
+                last_sent = time.time()
+            elif time.time() - last_sent > STREAM_KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.time()
+            time.sleep(STREAM_POLL_SECONDS)
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 if __name__ == '__main__':
     print("📊 Starting LLMOps Monitoring Dashboard...")
     print("🌐 Open: http://localhost:5001")
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001, threaded=True)
\ No newline at end of file
@@ -0,0 +1,245 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_MAX_ENTRIES = 100_000    # ~600 MB at 1536 float32 dims; LRU beyond this
+EVICTION_CHECK_INTERVAL = 100    # Check the size limit every N inserts
+TOUCH_INTERVAL_SECONDS = 60      # Don't rewrite last_used more often than this
+SQLITE_BUSY_TIMEOUT_MS = 5000
+SQLITE_MAX_PARAMS = 500          # Keys per SELECT ... IN (...) lookup
+
+
+def normalize_query(text: str) -> str:
+    """Case- and whitespace-insensitive form used as the cache key (and embedded)."""
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class EmbeddingCache:
+    """
+    On-disk, content-addressed cache of query embeddings.
+
+    Keyed by a hash of (embedding model, normalized text); vectors are stored
+    as float32 blobs in SQLite. WAL mode lets several worker processes read
+    and write the same file concurrently, so the cache survives restarts and
+    is shared across workers. Least-recently-used entries are evicted once
+    the cache exceeds max_entries.
+
+    The cache is best-effort: any SQLite error (locked past the busy
+    timeout, corrupt file, full disk) is logged and counted, and the lookup
+    becomes a miss or the write is skipped, so callers fall back to the
+    embeddings API instead of failing the request.
+    """
+
+    def __init__(self, path: str = "cache/query_embeddings.sqlite3",
+                 max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._inserts_since_check = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.enabled = True
+
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = self._connection()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    vector BLOB NOT NULL,
+                    last_used INTEGER NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+            conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            # Serve every query from the API rather than refusing to start
+            self._error("open", e)
+            self.enabled = False
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; SQLite connections aren't thread-safe."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
+            conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _error(self, operation: str, error: Exception):
+        print(f"Embedding cache {operation} error ({self.path}): {str(error)}")
+        with self._lock:
+            self.errors += 1
+
+    @staticmethod
+    def key(model: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model}\0{normalize_query(text)}".encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, model: str, texts: List[str]) -> Dict[int, List[float]]:
+        """
+        Look up cached vectors.
+
+        Returns:
+            dict of position in `texts` -> vector, for hits only
+        """
+        if not texts:
+            return {}
+        keys = [self.key(model, text) for text in texts]
+        rows = []
+        if self.enabled:
+            try:
+                conn = self._connection()
+                for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+                    chunk = keys[start:start + SQLITE_MAX_PARAMS]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows.extend(conn.execute(
+                        f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({placeholders})",
+                        chunk
+                    ).fetchall())
+            except sqlite3.Error as e:
+                self._error("read", e)
+                rows = []
+
+        found = {}
+        stale = []
+        now = int(time.time())
+        for key, blob, last_used in rows:
+            vector = array("f")
+            vector.frombytes(blob)
+            found[key] = vector.tolist()
+            if now - last_used > TOUCH_INTERVAL_SECONDS:
+                stale.append(key)
+
+        if stale:
+            self._touch(stale, now)
+
+        hits = {i: found[key] for i, key in enumerate(keys) if key in found}
+        with self._lock:
+            self.hits += len(hits)
+            self.misses += len(texts) - len(hits)
+        return hits
+
+    def _touch(self, keys: List[bytes], now: int):
+        """
+        Coarse LRU: refresh recency without writing on every hit.
+
+        Best-effort and non-blocking: if another process holds the write
+        lock, skip the refresh rather than stall the read path on it.
+        """
+        try:
+            conn = self._connection()
+            conn.execute("PRAGMA busy_timeout=0")
+            try:
+                with conn:
+                    conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in keys])
+            finally:
+                conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        except sqlite3.Error as e:
+            # Busy is expected under load; the next hit after TOUCH_INTERVAL_SECONDS retries
+            if "locked" not in str(e):
+                self._error("touch", e)
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text]).get(0)
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        if not texts or not self.enabled:
+            return
+        now = int(time.time())
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(self.key(model, text), array("f", vector).tobytes(), now)
+                     for text, vector in zip(texts, vectors)]
+                )
+        except sqlite3.Error as e:
+            self._error("write", e)
+            return
+
+        with self._lock:
+            self._inserts_since_check += len(texts)
+            check = self._inserts_since_check >= EVICTION_CHECK_INTERVAL
+            if check:
+                self._inserts_since_check = 0
+        if check:
+            self._evict()
+
+    def _evict(self):
+        """Drop least-recently-used entries down to 90% of max_entries."""
+        try:
+            conn = self._connection()
+            (count,) = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            if count <= self.max_entries:
+                return
+            excess = count - int(self.max_entries * 0.9)
+            with conn:
+                conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+        except sqlite3.Error as e:
+            self._error("eviction", e)
+
+    def get_stats(self) -> Dict:
+        """Hit/miss counts since startup and SQLite errors (each served from the API)."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "errors": self.errors,
+            }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated queries from an EmbeddingCache.
+
+    Queries are normalized before embedding so a cache hit returns exactly
+    what a miss would have. Documents (ingestion) pass straight through.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed many queries, calling the API only for cache misses (in one batch)."""
+        normalized = [normalize_query(text) for text in texts]
+        vectors = self.cache.get_many(self.model, normalized)
+
+        # De-duplicate misses so repeated questions in a batch are embedded once
+        misses = list(dict.fromkeys(text for i, text in enumerate(normalized) if i not in vectors))
+        if misses:
+            new_vectors = self.embeddings.embed_documents(misses)
+            self.cache.put_many(self.model, misses, new_vectors)
+            by_text = dict(zip(misses, new_vectors))
+            for i, text in enumerate(normalized):
+                if i not in vectors:
+                    vectors[i] = by_text[text]
+
+        return [vectors[i] for i in range(len(texts))]
@@ -0,0 +1,213 @@
+import glob
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Dialogflow agent export with labelled training phrases (*_usersays_en.json)
+INTENTS_DIR = os.path.join(os.path.dirname(__file__), '..', 'dialogflow-agent', 'intents')
+USERSAYS_SUFFIX = "_usersays_en.json"
+
+# Knowledge base docs; their lines are the negative (documentation) class
+KNOWLEDGE_BASE_DIR = os.path.join(os.path.dirname(__file__), 'knowledge_base')
+DOCUMENTATION_INTENT = "general_knowledge"
+
+# Cheap account handlers that low-confidence RAG queries may be re-routed to
+REROUTE_INTENTS = {"api_authentication", "api_rate_limit", "billing_question", "password_reset"}
+
+# Only second-guess Dialogflow when it wasn't sure about general_knowledge...
+DIALOGFLOW_CONFIDENCE_THRESHOLD = 0.7
+# ...and only when our classifier is confident and clearly prefers one intent
+MIN_CONFIDENCE = 0.45
+MIN_MARGIN = 0.1
+
+# Account handlers only help with questions about the user's own account:
+# a possessive ("my plan"), a first-person account problem, or an email
+ACCOUNT_SPECIFIC_PATTERN = re.compile(
+    r"\b(my|mine|our)\b"
+    r"|\bi\s*(forgot|lost|can'?t|cannot|am locked|'m locked)\b"
+    r"|\blocked out\b"
+    r"|[\w.+-]+@[\w-]+\.[\w.-]+",
+    re.IGNORECASE
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word unigrams and bigrams with light suffix stripping."""
+    words = []
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        for suffix in ("ing", "ed", "es", "s"):
+            if len(word) > len(suffix) + 2 and word.endswith(suffix):
+                word = word[:-len(suffix)]
+                break
+        words.append(word)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class IntentClassifier:
+    """
+    Lightweight TF-IDF nearest-neighbour intent classifier.
+
+    Trained from the Dialogflow agent's training phrases so the webhook can
+    double-check Dialogflow's routing in-process, with no API calls. An
+    intent's score is the best cosine similarity between the query and any
+    of its training phrases.
+    """
+
+    def __init__(self, examples: Dict[str, List[str]]):
+        """
+        Args:
+            examples: intent name -> list of training phrases
+        """
+        phrases = [(intent, tokenize(text)) for intent, texts in examples.items() for text in texts]
+
+        document_frequency = Counter()
+        for _, tokens in phrases:
+            document_frequency.update(set(tokens))
+        n = len(phrases)
+        self.idf = {
+            token: math.log((1 + n) / (1 + df)) + 1
+            for token, df in document_frequency.items()
+        }
+
+        self.vectors = [(intent, self._vectorize(tokens)) for intent, tokens in phrases]
+        self.intents = sorted(examples)
+
+    @classmethod
+    def from_dialogflow_export(cls, intents_dir: str = INTENTS_DIR,
+                               knowledge_base_dir: str = KNOWLEDGE_BASE_DIR) -> "IntentClassifier":
+        """
+        Build a classifier from the *_usersays_en.json files of an agent export.
+
+        Lines of the knowledge base documents become examples of
+        general_knowledge, so documentation questions have a class to match.
+        """
+        examples = {DOCUMENTATION_INTENT: knowledge_base_phrases(knowledge_base_dir)}
+        for path in sorted(glob.glob(os.path.join(intents_dir, f"*{USERSAYS_SUFFIX}"))):
+            intent = os.path.basename(path)[:-len(USERSAYS_SUFFIX)]
+            with open(path, 'r') as f:
+                usersays = json.load(f)
+            examples[intent] = [
+                "".join(part["text"] for part in phrase["data"])
+                for phrase in usersays
+            ]
+        return cls(examples)
+
+    def _vectorize(self, tokens: List[str]) -> Dict[str, float]:
+        """Sublinear TF-IDF vector, L2-normalized. Unknown tokens are dropped."""
+        counts = Counter(t for t in tokens if t in self.idf)
+        vector = {t: (1 + math.log(c)) * self.idf[t] for t, c in counts.items()}
+        norm = math.sqrt(sum(w * w for w in vector.values()))
+        return {t: w / norm for t, w in vector.items()} if norm else {}
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Best cosine similarity per intent (0-1)."""
+        query = self._vectorize(tokenize(text))
+        best = {intent: 0.0 for intent in self.intents}
+        for intent, vector in self.vectors:
+            similarity = sum(w * vector.get(t, 0.0) for t, w in query.items())
+            if similarity > best[intent]:
+                best[intent] = similarity
+        return best
+
+    def predict(self, text: str) -> Tuple[Optional[str], float, float]:
+        """
+        Returns:
+            (intent, confidence, margin over the runner-up intent);
+            intent is None if nothing matched
+        """
+        ranked = sorted(self.scores(text).items(), key=lambda s: s[1], reverse=True)
+        if not ranked or ranked[0][1] == 0:
+            return None, 0.0, 0.0
+        runner_up = ranked[1][1] if len(ranked) > 1 else 0.0
+        return ranked[0][0], ranked[0][1], ranked[0][1] - runner_up
+
+
+def knowledge_base_phrases(knowledge_base_dir: str = KNOWLEDGE_BASE_DIR) -> List[str]:
+    """Headings and prose/list lines of the markdown docs, minus code blocks."""
+    phrases = []
+    for path in sorted(glob.glob(os.path.join(knowledge_base_dir, "**", "*.md"), recursive=True)):
+        in_code = False
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith("```"):
+                    in_code = not in_code
+                    continue
+                text = re.sub(r"^(#+|[-*]|\d+\.)\s*", "", line)
+                if not in_code and len(text.split()) >= 2:
+                    phrases.append(text)
+    return phrases
+
+
+def is_account_specific(query_text: str) -> bool:
+    """True if the question is about the asker's own account rather than the product."""
+    return bool(ACCOUNT_SPECIFIC_PATTERN.search(query_text))
+
+
+def reroute_intent(classifier: IntentClassifier, intent_name: str, query_text: str,
+                   dialogflow_confidence: Optional[float]) -> Optional[str]:
+    """
+    Decide whether a general_knowledge request should go to an account handler.
+
+    Returns the intent to dispatch to instead, or None to keep Dialogflow's choice.
+    """
+    if intent_name != DOCUMENTATION_INTENT or not query_text:
+        return None
+    # No confidence reported means we can't tell Dialogflow was unsure
+    if dialogflow_confidence is None or dialogflow_confidence >= DIALOGFLOW_CONFIDENCE_THRESHOLD:
+        return None
+    if not is_account_specific(query_text):
+        return None
+
+    predicted, confidence, margin = classifier.predict(query_text)
+    if predicted in REROUTE_INTENTS and confidence >= MIN_CONFIDENCE and margin >= MIN_MARGIN:
+        return predicted
+    return None
+
+
+# Singleton instance
+_classifier_instance = None
+
+def get_intent_classifier():
+    """Get or create the intent classifier (trained once from the agent export)"""
+    global _classifier_instance
+    if _classifier_instance is None:
+        _classifier_instance = IntentClassifier.from_dialogflow_export()
+    return _classifier_instance
+
+
+# Routing self-check
+if __name__ == "__main__":
+    # Documentation questions must stay on RAG; account questions should re-route
+    classifier = get_intent_classifier()
+
+    stays_on_rag = [
+        "What payment methods do you accept?",
+        "What are the rate limits on the Free plan?",
+        "What happens when I exceed rate limits?",
+        "How do I authenticate API requests with OAuth?",
+        "What is the refund policy?",
+        "How do I connect Slack?",
+    ]
+    reroutes = {
+        "what are my rate limits": "api_rate_limit",
+        "I forgot my password": "password_reset",
+        "how much does my subscription cost": "billing_question",
+        "my api key is not working": "api_authentication",
+    }
+
+    failures = 0
+    for query in stays_on_rag:
+        routed = reroute_intent(classifier, DOCUMENTATION_INTENT, query, 0.5)
+        print(f"{'ok  ' if routed is None else 'FAIL'} {query!r} -> {routed or DOCUMENTATION_INTENT}")
+        failures += routed is not None
+    for query, expected in reroutes.items():
+        routed = reroute_intent(classifier, DOCUMENTATION_INTENT, query, 0.5)
+        print(f"{'ok  ' if routed == expected else 'FAIL'} {query!r} -> {routed or DOCUMENTATION_INTENT}")
+        failures += routed != expected
+
+    print(f"{failures} routing failures")
+    raise SystemExit(1 if failures else 0)
@@ -0,0 +1,197 @@
+import re
+import threading
+from typing import Dict, List
+
+# Routes, cheapest first
+ROUTE_EXTRACTIVE = "extractive"  # Answer quoted from the top chunk, no LLM call
+ROUTE_FAST = "fast"              # Short prompt, top chunk only, tight token cap
+ROUTE_FULL = "full"              # Full prompt over all retrieved chunks
+ROUTES = [ROUTE_EXTRACTIVE, ROUTE_FAST, ROUTE_FULL]
+
+# Retrieval relevance (0-1) the top chunk needs for each cheap route
+EXTRACTIVE_MIN_RELEVANCE = 0.65
+FAST_MIN_RELEVANCE = 0.45
+# How far the top chunk must lead the runner-up to count as "single-chunk"
+MIN_RELEVANCE_MARGIN = 0.05
+
+# Share of the question's content words an extractive passage must contain
+EXTRACTIVE_MIN_COVERAGE = 1.0
+
+# Query features
+FAST_MAX_WORDS = 15
+EXTRACTIVE_MAX_WORDS = 8
+MULTI_PART_PATTERN = re.compile(
+    r"\b(and|or|vs|versus|compare|comparison|difference|differences|between|both|"
+    r"why|explain|troubleshoot|step[- ]by[- ]step)\b",
+    re.IGNORECASE
+)
+
+# LLMOps: Pricing per 1M tokens (USD) for cost tracking - update with the price sheet
+MODEL_PRICING = {
+    "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+}
+
+STOP_WORDS = {
+    "a", "an", "the", "is", "are", "do", "does", "i", "my", "me", "we", "our",
+    "you", "your", "to", "of", "in", "on", "for", "how", "what", "can", "it",
+    "with", "be", "this", "that", "there", "any", "much", "many"
+}
+
+
+def relevance(doc) -> float:
+    """Retrieval relevance stored on a Document by the RAG engine (0 if missing)."""
+    return doc.metadata.get("relevance_score", 0.0)
+
+
+def query_terms(text: str) -> set:
+    return {w for w in re.findall(r"[a-z0-9]+", text.lower()) if w not in STOP_WORDS}
+
+
+def extractive_answer(query: str, doc, max_lines: int = 6,
+                      min_coverage: float = EXTRACTIVE_MIN_COVERAGE) -> str:
+    """
+    Build an answer by quoting the passage of a chunk that best matches the query.
+
+    A passage starts at a matching line and runs to the end of its paragraph
+    (blank line or markdown heading), so setup steps stay together. Passages
+    are tried best-overlap first; one is only used if it contains at least
+    `min_coverage` of the question's content words. Returns an empty string
+    if no passage qualifies, so the caller can fall back to the LLM.
+    """
+    terms = query_terms(query)
+    if not terms:
+        return ""
+    lines = [line.strip() for line in doc.page_content.splitlines()]
+
+    candidates = []
+    for position, line in enumerate(lines):
+        overlap = len(terms & query_terms(line))
+        if overlap:
+            candidates.append((-overlap, position))
+
+    for _, position in sorted(candidates):
+        passage = [lines[position].lstrip("#").strip()]
+        for line in lines[position + 1:position + max_lines + 1]:
+            if not line and passage[-1].endswith(":"):
+                continue  # "To connect Slack:" followed by a blank line, then the steps
+            if not line or line.startswith("#"):
+                break
+            passage.append(line)
+
+        coverage = len(terms & query_terms(" ".join(passage))) / len(terms)
+        if coverage >= min_coverage:
+            return "\n".join(passage)
+    return ""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars/token) when the API doesn't report usage."""
+    return max(1, len(text) // 4)
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> float:
+    pricing = MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (input_tokens * pricing["input"] + output_tokens * pricing["output"]) / 1_000_000
+
+
+class ModelRouter:
+    """
+    Picks a generation route per request from retrieval scores and query features.
+
+    - extractive: short factual question, one clearly best chunk with high
+      relevance -> quote it, skip the LLM entirely
+    - fast: short single-topic question answered by one chunk -> short prompt
+      with just that chunk and a strict max_tokens
+    - full: multi-part questions, weak or spread-out retrieval -> full prompt
+
+    A fast answer that says the excerpt doesn't cover the question is
+    retried on the full route; those escalations are counted on the fast
+    route so a misjudging threshold shows up in the stats.
+
+    LLMOps Practice: Per-route request count, latency and cost tracking
+    """
+
+    def __init__(self, enable_extractive: bool = False):
+        """
+        Args:
+            enable_extractive: allow the no-LLM route. Off by default until
+                EXTRACTIVE_MIN_RELEVANCE is calibrated against real Chroma scores;
+                the webhook turns it on with ENABLE_EXTRACTIVE_ROUTE=1.
+        """
+        self.enable_extractive = enable_extractive
+        self._lock = threading.Lock()
+        self._stats = {route: self._empty_stats() for route in ROUTES}
+
+    @staticmethod
+    def _empty_stats() -> Dict:
+        return {
+            "requests": 0,
+            "total_latency_ms": 0.0,
+            "max_latency_ms": 0.0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cost_usd": 0.0,
+            "escalations": 0,
+        }
+
+    def choose(self, query: str, docs: List) -> str:
+        """Return the route for this query given its retrieved chunks."""
+        if not docs:
+            return ROUTE_FULL
+
+        words = len(query.split())
+        multi_part = bool(MULTI_PART_PATTERN.search(query)) or query.count("?") > 1
+
+        scores = sorted((relevance(doc) for doc in docs), reverse=True)
+        top = scores[0]
+        margin = top - scores[1] if len(scores) > 1 else top
+        single_chunk = margin >= MIN_RELEVANCE_MARGIN
+
+        if multi_part or not single_chunk:
+            return ROUTE_FULL
+        if (self.enable_extractive and words <= EXTRACTIVE_MAX_WORDS
+                and top >= EXTRACTIVE_MIN_RELEVANCE):
+            return ROUTE_EXTRACTIVE
+        if words <= FAST_MAX_WORDS and top >= FAST_MIN_RELEVANCE:
+            return ROUTE_FAST
+        return ROUTE_FULL
+
+    def record(self, route: str, latency_ms: float, model: str = None,
+               input_tokens: int = 0, output_tokens: int = 0, escalated: bool = False):
+        """
+        Track latency, token usage and estimated cost for one routed request.
+
+        escalated: the route's answer was discarded and the request retried
+            on a more expensive route (recorded there separately)
+        """
+        cost = estimate_cost(model, input_tokens, output_tokens) if model else 0.0
+        with self._lock:
+            stats = self._stats[route]
+            stats["requests"] += 1
+            stats["total_latency_ms"] += latency_ms
+            stats["max_latency_ms"] = max(stats["max_latency_ms"], latency_ms)
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            stats["cost_usd"] += cost
+            if escalated:
+                stats["escalations"] += 1
+        return cost
+
+    def get_stats(self) -> Dict:
+        """Per-route counters with average latency and cost per request."""
+        with self._lock:
+            report = {}
+            for route, stats in self._stats.items():
+                requests = stats["requests"]
+                report[route] = {
+                    **stats,
+                    "total_latency_ms": round(stats["total_latency_ms"], 2),
+                    "max_latency_ms": round(stats["max_latency_ms"], 2),
+                    "cost_usd": round(stats["cost_usd"], 6),
+                    "avg_latency_ms": round(stats["total_latency_ms"] / requests, 2) if requests else 0,
+                    "avg_cost_usd": round(stats["cost_usd"] / requests, 6) if requests else 0,
+                    "escalation_rate": round(stats["escalations"] / requests, 4) if requests else 0,
+                }
+            return report
@@ -1,8 +1,34 @@
+import atexit
+import fcntl
 import json
+import math
 import os
-from datetime import datetime
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from collections import Counter
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+# Upper bounds (ms) of the latency histogram kept per rollup bucket.
+# Percentiles are estimated from these, so keep them dense around the SLO.
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 1500, 2000, 3000, 5000, 10000, 30000]
+
+# resolution -> (timestamp prefix length used as bucket key, period, buckets retained)
+ROLLUP_RESOLUTIONS = {
+    "minute": (16, timedelta(minutes=1), 6 * 60),  # "2025-11-04T11:44" - last 6 hours
+    "hour": (13, timedelta(hours=1), 14 * 24),     # "2025-11-04T11"    - last 14 days
+    "day": (10, timedelta(days=1), 365),           # "2025-11-04"       - last year
+}
+
+# Bump when the rollup file layout changes; older files are rebuilt from the log
+ROLLUP_SCHEMA_VERSION = 2
+
+# Logged queries are folded in and written by a background thread at most this often
+ROLLUP_FLUSH_INTERVAL_SECONDS = 1.0
+
+MAX_TRACKED_QUERIES = 1000
+RECENT_QUERIES = 10
 
 class QueryLogger:
     """
@@ -19,6 +45,12 @@ class QueryLogger:
     def __init__(self, log_file="logs/query_log.json"):
         self.log_file = log_file
         self._ensure_log_file()
+
+        # LLMOps: Pre-aggregated rollups so the dashboard never scans the full log
+        rollup_file = os.path.join(os.path.dirname(self.log_file), "rollups.json")
+        self.rollup = MetricsRollup(rollup_file)
+        if self.rollup.is_empty():
+            self.rollup.rebuild(self._read_logs())
     
     def _ensure_log_file(self):
         """Create log file if it doesn't exist"""
@@ -28,7 +60,8 @@ class QueryLogger:
                 json.dump([], f)
     
     def log_query(self, query: str, intent: str, response_time: float, 
-                  sources: List[str] = None, user_email: str = None):
+                  sources: List[str] = None, user_email: str = None,
+                  route: str = None):
         """
         Log a query with metadata.
         
@@ -43,6 +76,8 @@ class QueryLogger:
             "user_email": user_email,
             "query_length": len(query)
         }
+        if route:
+            log_entry["route"] = route  # RAG generation route (extractive/fast/full)
         
         # Append to log file
         logs = self._read_logs()
@@ -50,6 +85,8 @@ class QueryLogger:
         
         with open(self.log_file, 'w') as f:
             json.dump(logs, f, indent=2)
+
+        self.rollup.record(log_entry)
     
     def _read_logs(self) -> List[Dict]:
         """Read all logs from file"""
@@ -108,6 +145,327 @@ class QueryLogger:
             "recent_queries": logs[-10:]  # Last 10 queries
         }
 
+
+class MetricsRollup:
+    """
+    Time-series rollups of logged queries for the monitoring dashboard.
+
+    Every logged query is folded into per-minute buckets and downsampled
+    into hourly and daily buckets as it arrives, alongside running totals.
+    Each bucket keeps a count, latency sum/max and a fixed latency histogram
+    (for p95), overall and per intent, so reads cost O(buckets) instead of
+    O(log entries).
+
+    The rollups are persisted to a small JSON file so the dashboard (a
+    separate process) can serve them without touching the webhook. Writers
+    take an exclusive file lock around read-modify-write, so several webhook
+    processes can share one rollup file.
+
+    Recording only queues the entry: a background thread folds queued
+    entries in and rewrites the file at most once per
+    ROLLUP_FLUSH_INTERVAL_SECONDS, so requests never wait on the file lock
+    or the JSON encode. Readers may lag by up to that interval.
+    """
+
+    def __init__(self, rollup_file="logs/rollups.json"):
+        self.rollup_file = rollup_file
+        self.lock_file = f"{rollup_file}.lock"
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._state = self._empty_state()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flush_wanted = threading.Event()
+        self._flusher = None
+        self.refresh()
+        # Don't lose the last interval's queries on shutdown
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _empty_state() -> Dict:
+        return {
+            "schema": ROLLUP_SCHEMA_VERSION,
+            "version": 0,
+            "updated_at": None,
+            "series": {resolution: {} for resolution in ROLLUP_RESOLUTIONS},
+            "totals": {
+                "count": 0,
+                "latency_sum_ms": 0.0,
+                "rag_count": 0,
+                "intents": {},
+                "sources": {},
+                "queries": {},
+                "recent": [],
+            },
+        }
+
+    @staticmethod
+    def _empty_bucket() -> Dict:
+        return {
+            "count": 0,
+            "latency_sum_ms": 0.0,
+            "latency_max_ms": 0.0,
+            "hist": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+        }
+
+    @property
+    def version(self) -> int:
+        """Monotonic counter bumped on every recorded query."""
+        return self._state["version"]
+
+    def is_empty(self) -> bool:
+        return self._state["totals"]["count"] == 0
+
+    def refresh(self) -> bool:
+        """
+        Reload rollups if another process has written them since we last looked.
+
+        Returns True if the in-memory state changed.
+        """
+        with self._lock:
+            return self._reload()
+
+    def _reload(self) -> bool:
+        # Caller holds self._lock
+        try:
+            mtime = os.stat(self.rollup_file).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._mtime:
+            return False
+
+        try:
+            with open(self.rollup_file, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            # Mid-write or corrupt file: keep serving what we have
+            return False
+
+        self._mtime = mtime
+        if state.get("schema") != ROLLUP_SCHEMA_VERSION:
+            # Written by an older version; QueryLogger rebuilds it from the log
+            return False
+        self._state = state
+        return True
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared by every process writing this rollup file."""
+        os.makedirs(os.path.dirname(self.rollup_file) or ".", exist_ok=True)
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def record(self, log_entry: Dict):
+        """Queue a query log entry; the background flusher persists it."""
+        with self._pending_lock:
+            self._pending.append(log_entry)
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="rollup-flusher", daemon=True)
+                self._flusher.start()
+        self._flush_wanted.set()
+
+    def _flush_loop(self):
+        while True:
+            self._flush_wanted.wait()
+            self._flush_wanted.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Rollup flush error: {str(e)}")
+            # Entries logged meanwhile are batched into the next write
+            time.sleep(ROLLUP_FLUSH_INTERVAL_SECONDS)
+
+    def flush(self):
+        """Fold every queued entry into each resolution and persist, in one locked write."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+        with self._lock, self._file_lock():
+            # Pick up other processes' writes before adding ours
+            self._reload()
+            for log_entry in pending:
+                self._add(log_entry)
+            self._state["version"] += len(pending)
+            self._state["updated_at"] = datetime.now().isoformat()
+            self._save()
+
+    def rebuild(self, logs: List[Dict]):
+        """Backfill rollups from an existing query log (one-time migration)."""
+        if not logs:
+            return
+        with self._lock, self._file_lock():
+            # Another process may have rebuilt while we waited for the lock
+            self._reload()
+            if not self.is_empty():
+                return
+            self._state = self._empty_state()
+            for log_entry in logs:
+                self._add(log_entry)
+            self._state["version"] = len(logs)
+            self._state["updated_at"] = datetime.now().isoformat()
+            self._save()
+
+    def _add(self, log_entry: Dict):
+        timestamp = log_entry["timestamp"]
+        latency = log_entry["response_time_ms"]
+        intent = log_entry["intent"]
+
+        for resolution, (key_length, _, retained) in ROLLUP_RESOLUTIONS.items():
+            series = self._state["series"][resolution]
+            key = timestamp[:key_length]
+            bucket = series.get(key)
+            if bucket is None:
+                bucket = series[key] = self._empty_bucket()
+                bucket["by_intent"] = {}
+                # Keys are ISO prefixes, so lexical order is time order
+                for stale in sorted(series)[:-retained]:
+                    del series[stale]
+            self._add_to_bucket(bucket, latency)
+            if intent not in bucket["by_intent"]:
+                bucket["by_intent"][intent] = self._empty_bucket()
+            self._add_to_bucket(bucket["by_intent"][intent], latency)
+
+        totals = self._state["totals"]
+        totals["count"] += 1
+        totals["latency_sum_ms"] += latency
+        totals["intents"][intent] = totals["intents"].get(intent, 0) + 1
+        if intent == "general_knowledge":
+            totals["rag_count"] += 1
+            for source in log_entry.get("sources", []):
+                totals["sources"][source] = totals["sources"].get(source, 0) + 1
+
+        queries = totals["queries"]
+        query_text = log_entry["query"].lower()
+        queries[query_text] = queries.get(query_text, 0) + 1
+        if len(queries) > MAX_TRACKED_QUERIES:
+            # Keep memory bounded: drop the long tail of one-off queries
+            keep = Counter(queries).most_common(int(MAX_TRACKED_QUERIES * 0.8))
+            totals["queries"] = dict(keep)
+
+        totals["recent"] = (totals["recent"] + [log_entry])[-RECENT_QUERIES:]
+
+    @staticmethod
+    def _add_to_bucket(bucket: Dict, latency: float):
+        bucket["count"] += 1
+        bucket["latency_sum_ms"] += latency
+        bucket["latency_max_ms"] = max(bucket["latency_max_ms"], latency)
+        index = len(LATENCY_BUCKETS_MS)
+        for i, upper in enumerate(LATENCY_BUCKETS_MS):
+            if latency <= upper:
+                index = i
+                break
+        bucket["hist"][index] += 1
+
+    def _merge(self, buckets: List[Dict]) -> Dict:
+        merged = self._empty_bucket()
+        for bucket in buckets:
+            merged["count"] += bucket["count"]
+            merged["latency_sum_ms"] += bucket["latency_sum_ms"]
+            merged["latency_max_ms"] = max(merged["latency_max_ms"], bucket["latency_max_ms"])
+            merged["hist"] = [a + b for a, b in zip(merged["hist"], bucket["hist"])]
+        return merged
+
+    def _save(self):
+        """Atomically replace the rollup file so readers never see a partial write."""
+        tmp_file = f"{self.rollup_file}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            # json.dumps uses the C encoder; json.dump streams through the pure-Python one
+            f.write(json.dumps(self._state, separators=(",", ":")))
+        os.replace(tmp_file, self.rollup_file)
+        self._mtime = os.stat(self.rollup_file).st_mtime_ns
+
+    @staticmethod
+    def _percentile(bucket: Dict, q: float) -> float:
+        """Estimate a latency percentile from the bucket histogram."""
+        if bucket["count"] == 0:
+            return 0
+        rank = math.ceil(q * bucket["count"])
+        seen = 0
+        for i, n in enumerate(bucket["hist"]):
+            seen += n
+            if seen >= rank:
+                if i < len(LATENCY_BUCKETS_MS):
+                    return min(LATENCY_BUCKETS_MS[i], bucket["latency_max_ms"])
+                break
+        return bucket["latency_max_ms"]
+
+    @staticmethod
+    def _window_keys(resolution: str, limit: int, now: Optional[datetime] = None) -> List[str]:
+        """Bucket keys for the `limit` periods ending with the current one, oldest first."""
+        key_length, step, _ = ROLLUP_RESOLUTIONS[resolution]
+        now = now or datetime.now()
+        return [(now - step * i).isoformat()[:key_length] for i in range(limit - 1, -1, -1)]
+
+    def timeseries(self, resolution: str = "minute", limit: int = 60,
+                   intent: Optional[str] = None, now: Optional[datetime] = None) -> List[Dict]:
+        """
+        Return the `limit` buckets at the given resolution ending now.
+
+        Periods with no traffic are included with zero values, so the series
+        is evenly spaced in time. With `intent`, every statistic covers only
+        that intent's queries. `bucket` is the ISO time prefix.
+        """
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        retained = ROLLUP_RESOLUTIONS[resolution][2]
+        limit = max(1, min(limit, retained))
+
+        with self._lock:
+            series = self._state["series"][resolution]
+            points = []
+            for key in self._window_keys(resolution, limit, now):
+                bucket = series.get(key)
+                by_intent = bucket["by_intent"] if bucket else {}
+                if intent:
+                    bucket = by_intent.get(intent)
+                bucket = bucket or self._empty_bucket()
+                count = bucket["count"]
+                points.append({
+                    "bucket": key,
+                    "count": count,
+                    "avg_response_time_ms": round(bucket["latency_sum_ms"] / count, 2) if count else 0,
+                    "p95_response_time_ms": round(self._percentile(bucket, 0.95), 2),
+                    "max_response_time_ms": round(bucket["latency_max_ms"], 2),
+                    "queries_by_intent": (
+                        {intent: count} if intent and count
+                        else {} if intent
+                        else {name: b["count"] for name, b in by_intent.items()}
+                    ),
+                })
+        return points
+
+    def summary(self, now: Optional[datetime] = None) -> Dict:
+        """
+        Dashboard metrics computed from the rollups.
+
+        Same shape as QueryLogger.get_metrics(), plus p95 over the last 60 minutes.
+        """
+        with self._lock:
+            totals = self._state["totals"]
+            count = totals["count"]
+            minutes = self._state["series"]["minute"]
+            last_hour = self._merge([
+                minutes[key] for key in self._window_keys("minute", 60, now) if key in minutes
+            ])
+            return {
+                "total_queries": count,
+                "avg_response_time_ms": round(totals["latency_sum_ms"] / count, 2) if count else 0,
+                "p95_response_time_ms": round(self._percentile(last_hour, 0.95), 2),
+                "total_rag_queries": totals["rag_count"],
+                "most_common_queries": Counter(totals["queries"]).most_common(10),
+                "source_usage": dict(Counter(totals["sources"]).most_common()),
+                "queries_by_intent": dict(totals["intents"]),
+                "recent_queries": list(totals["recent"]),
+                "version": self._state["version"],
+                "updated_at": self._state["updated_at"],
+            }
+
+
 # Singleton instance
 _logger_instance = None
 
@@ -0,0 +1,282 @@
+import heapq
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import Dict, List, Optional
+from flask import g, request
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+DEFAULT_INTERVAL_MS = 2.0   # Sampling interval
+MAX_STACK_DEPTH = 128
+SLOWEST_KEPT = 50           # Slowest requests remembered for the aggregate view
+RECENT_KEPT = 20            # Latest profiles kept on disk however fast, so returned ids resolve
+TOP_FUNCTIONS = 10
+
+
+class StackSampler:
+    """
+    Samples one thread's Python stack on a timer from a background thread.
+
+    Cheap enough to leave on for a single request: no tracing hooks, just
+    sys._current_frames() every interval. Each sample is weighted by the
+    real time since the previous one, so slow I/O (OpenAI, Chroma, file
+    writes) shows up at its true cost.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.frames = []        # speedscope shared frame table
+        self._frame_index = {}  # (name, file, line) -> index in self.frames
+        self.stacks = Counter()  # tuple of frame indexes (root first) -> weight (s)
+        self.started = 0.0
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self.started
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.stacks[self._stack(frame)] += now - last
+            last = now
+
+    def _stack(self, frame) -> tuple:
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self._frame_index.get(key)
+            if index is None:
+                index = self._frame_index[key] = len(self.frames)
+                self.frames.append({"name": code.co_name, "file": code.co_filename, "line": code.co_firstlineno})
+            stack.append(index)
+            frame = frame.f_back
+        return tuple(reversed(stack))
+
+    def frame_label(self, index: int) -> str:
+        frame = self.frames[index]
+        return f"{frame['name']} ({os.path.basename(frame['file'])}:{frame['line']})"
+
+    def to_speedscope(self, name: str) -> Dict:
+        """Profile in speedscope's file format (open at https://www.speedscope.app)."""
+        stacks = list(self.stacks.items())
+        weights_ms = [round(weight * 1000, 3) for _, weight in stacks]
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": self.frames},
+            "profiles": [{
+                "type": "sampled",
+                "name": name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights_ms), 3),
+                "samples": [list(stack) for stack, _ in stacks],
+                "weights": weights_ms,
+            }],
+            "name": name,
+            "exporter": "customer-support-chatbot profiler",
+        }
+
+    def to_collapsed(self) -> str:
+        """Brendan Gregg's collapsed-stack format for flamegraph.pl (weights in µs)."""
+        lines = []
+        for stack, weight in self.stacks.items():
+            frames = ";".join(self.frame_label(i).replace(";", ":") for i in stack)
+            lines.append(f"{frames} {max(1, int(weight * 1_000_000))}")
+        return "\n".join(lines) + "\n"
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[Dict]:
+        """Functions ranked by self time, with inclusive (total) time."""
+        self_time = Counter()
+        total_time = Counter()
+        for stack, weight in self.stacks.items():
+            if not stack:
+                continue
+            self_time[stack[-1]] += weight
+            for index in set(stack):
+                total_time[index] += weight
+        return [
+            {
+                "function": self.frame_label(index),
+                "self_ms": round(weight * 1000, 2),
+                "total_ms": round(total_time[index] * 1000, 2),
+            }
+            for index, weight in self_time.most_common(limit)
+        ]
+
+
+class RequestProfiler:
+    """
+    Opt-in per-request profiling for the Flask webhook.
+
+    A request is profiled when profiling is enabled and it carries the
+    `X-Profile: 1` header, or when it is picked by the sampling rate. Each
+    profile covers the whole request (webhook() through RAGEngine.search and
+    QueryLogger.log_query) and is written as speedscope JSON and a collapsed
+    flame graph under output_dir. The slowest requests are kept in memory
+    with the functions they spent the most time in. Only the files of those
+    and of the RECENT_KEPT latest profiles stay on disk; older files
+    (including ones left by earlier processes) are deleted, so output_dir
+    stays bounded.
+
+    Streaming responses are only profiled up to the point the stream starts.
+
+    LLMOps Practice: Find where latency goes without attaching a debugger
+    """
+
+    def __init__(self, enabled: bool = False, sample_rate: float = 0.0,
+                 interval_ms: float = DEFAULT_INTERVAL_MS,
+                 output_dir: str = "logs/profiles"):
+        """
+        Args:
+            enabled: honour the X-Profile header
+            sample_rate: fraction of requests (0-1) to profile regardless of header
+            interval_ms: stack sampling interval
+            output_dir: where profile files are written
+        """
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._slowest = []  # min-heap of (duration_ms, profile_id, summary)
+        self._recent = deque()  # ids of the latest profiles, oldest first
+        self._prune()
+
+    @classmethod
+    def from_env(cls) -> "RequestProfiler":
+        """Configure from PROFILING=1, PROFILE_SAMPLE_RATE and PROFILE_INTERVAL_MS."""
+        return cls(
+            enabled=os.getenv("PROFILING", "0") == "1",
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            interval_ms=float(os.getenv("PROFILE_INTERVAL_MS", DEFAULT_INTERVAL_MS))
+        )
+
+    def init_app(self, app, exclude_prefixes=("/profiles",)):
+        """Register request hooks on a Flask app."""
+        @app.before_request
+        def start_profile():
+            if request.path.startswith(exclude_prefixes) or not self._should_profile():
+                return
+            g.profiler = StackSampler(threading.get_ident(), self.interval)
+            g.profiler.start()
+
+        @app.after_request
+        def stop_profile(response):
+            sampler = g.pop('profiler', None)
+            if sampler is not None:
+                sampler.stop()
+                profile_id = self._save(sampler, request.method, request.path)
+                response.headers[PROFILE_ID_HEADER] = profile_id
+            return response
+
+        @app.teardown_request
+        def discard_profile(exc):
+            # after_request is skipped when the view raises; don't leak the sampler
+            sampler = g.pop('profiler', None)
+            if sampler is not None:
+                sampler.stop()
+
+    def _should_profile(self) -> bool:
+        if self.enabled and request.headers.get(PROFILE_HEADER) == "1":
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _save(self, sampler: StackSampler, method: str, path: str) -> str:
+        started = datetime.now()
+        profile_id = f"{started.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        name = f"{method} {path}"
+        duration_ms = round(sampler.duration * 1000, 2)
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self._path(profile_id, "speedscope.json"), 'w') as f:
+            json.dump(sampler.to_speedscope(name), f)
+        with open(self._path(profile_id, "collapsed.txt"), 'w') as f:
+            f.write(sampler.to_collapsed())
+
+        summary = {
+            "id": profile_id,
+            "request": name,
+            "timestamp": started.isoformat(),
+            "duration_ms": duration_ms,
+            "sampled_ms": round(sum(sampler.stacks.values()) * 1000, 2),
+            "top_functions": sampler.top_functions(),
+        }
+        print(f"[profile] {name} took {duration_ms}ms -> {self._path(profile_id, 'speedscope.json')}")
+
+        with self._lock:
+            dropped = []
+            entry = (duration_ms, profile_id, summary)
+            if len(self._slowest) < SLOWEST_KEPT:
+                heapq.heappush(self._slowest, entry)
+            else:
+                # May be the new entry itself if it's faster than all kept ones
+                dropped.append(heapq.heappushpop(self._slowest, entry)[1])
+            self._recent.append(profile_id)
+            if len(self._recent) > RECENT_KEPT:
+                dropped.append(self._recent.popleft())
+            # Files stay while the profile is either slow or recent
+            kept = {kept_id for _, kept_id, _ in self._slowest}.union(self._recent)
+            dropped = [dropped_id for dropped_id in dropped if dropped_id not in kept]
+        for dropped_id in dropped:
+            self._delete(dropped_id)
+        return profile_id
+
+    def _prune(self):
+        """Earlier processes' profiles aren't tracked: keep only the newest RECENT_KEPT."""
+        try:
+            names = os.listdir(self.output_dir)
+        except FileNotFoundError:
+            return
+        # Ids start with a timestamp, so they sort oldest first
+        profile_ids = sorted({
+            name.split(".", 1)[0] for name in names
+            if name.endswith((".speedscope.json", ".collapsed.txt"))
+        })
+        for profile_id in profile_ids[:-RECENT_KEPT]:
+            self._delete(profile_id)
+        self._recent.extend(profile_ids[-RECENT_KEPT:])
+
+    def _delete(self, profile_id: str):
+        """Remove a profile's files once it's no longer among the slowest kept."""
+        for suffix in ("speedscope.json", "collapsed.txt"):
+            try:
+                os.remove(self._path(profile_id, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _path(self, profile_id: str, suffix: str) -> str:
+        return os.path.join(self.output_dir, f"{profile_id}.{suffix}")
+
+    def slowest(self, limit: int = 10) -> List[Dict]:
+        """Slowest profiled requests, slowest first."""
+        with self._lock:
+            return [summary for _, _, summary in heapq.nlargest(limit, self._slowest)]
+
+    def profile_path(self, profile_id: str, fmt: str = "speedscope") -> Optional[str]:
+        """Path of a saved profile file, or None if it doesn't exist."""
+        suffix = {"speedscope": "speedscope.json", "collapsed": "collapsed.txt"}.get(fmt)
+        # Profile ids are generated by us; reject anything that could escape output_dir
+        if suffix is None or os.path.basename(profile_id) != profile_id:
+            return None
+        path = self._path(profile_id, suffix)
+        return path if os.path.exists(path) else None
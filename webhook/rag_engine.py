@@ -1,16 +1,33 @@
 import os
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from langchain_community.document_loaders import DirectoryLoader, TextLoader
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_community.vectorstores import Chroma
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import RunnableLambda, RunnablePassthrough
 from dotenv import load_dotenv
+from chunk_store import ChunkStore
+from embedding_cache import CachedEmbeddings, EmbeddingCache
+from model_router import (
+    ModelRouter, ROUTE_EXTRACTIVE, ROUTE_FAST, ROUTE_FULL, extractive_answer, estimate_tokens
+)
 
 # Load environment variables
 load_dotenv()
 
+# LLMOps: Embedding/generation models and per-route output caps
+EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_MODEL = "gpt-4o-mini"
+FULL_MAX_TOKENS = 800
+FAST_MAX_TOKENS = 200
+
+# Start of the fallback sentence both prompts use when the context lacks the answer
+NO_ANSWER_PREFIX = "I don't have that information"
+
 class RAGEngine:
     """
     RAG (Retrieval-Augmented Generation) engine for knowledge base search.
@@ -21,18 +38,24 @@ class RAGEngine:
     - LLM-powered answer generation with source attribution
     """
     
-    def __init__(self, knowledge_base_path="knowledge_base", persist_directory="./chroma_db"):
+    def __init__(self, knowledge_base_path="knowledge_base", persist_directory="./chroma_db",
+                 query_cache_path="./cache/query_embeddings.sqlite3"):
         """
         Initialize RAG engine.
         
         Args:
             knowledge_base_path: Path to markdown documents
             persist_directory: Where to store vector embeddings
+            query_cache_path: On-disk query embedding cache (shared across workers)
         """
         self.knowledge_base_path = knowledge_base_path
         self.persist_directory = persist_directory
+        self.query_cache_path = query_cache_path
         self.vectorstore = None
         self.qa_chain = None
+        self.top_k = 3  # Number of chunks retrieved per query
+        # No-LLM extractive route is opt-in until its thresholds are calibrated
+        self.router = ModelRouter(enable_extractive=os.getenv("ENABLE_EXTRACTIVE_ROUTE", "0") == "1")
         
         # Initialize components
         self._load_documents()
@@ -66,8 +89,10 @@ class RAGEngine:
             separators=["\n\n", "\n", " ", ""]
         )
         
-        self.chunks = text_splitter.split_documents(documents)
-        print(f"Split into {len(self.chunks)} chunks")
+        # Software Engineering: Keep chunks in a compact store rather than
+        # holding every Document object for the life of the process
+        self.chunk_store = ChunkStore.from_documents(text_splitter.split_documents(documents))
+        print(f"Split into {len(self.chunk_store)} chunks")
     
     def _create_vectorstore(self):
         """
@@ -79,20 +104,37 @@ class RAGEngine:
         
         # Use OpenAI embeddings
         # LLMOps: Track embedding model version for reproducibility
-        embeddings = OpenAIEmbeddings(
-            model="text-embedding-3-small",  # Cost-effective, good quality
+        self.embeddings = OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,  # Cost-effective, good quality
             openai_api_key=os.getenv("OPENAI_API_KEY")
         )
+
+        # Software Engineering: Repeated questions skip the embeddings API
+        self.query_embeddings = CachedEmbeddings(
+            self.embeddings,
+            EmbeddingCache(self.query_cache_path),
+            model=EMBEDDING_MODEL
+        )
         
         # Create Chroma vector store
-        # Software Engineering: Persistent storage for faster restarts
-        self.vectorstore = Chroma.from_documents(
-            documents=self.chunks,
-            embedding=embeddings,
+        # Software Engineering: Persistent storage for faster restarts.
+        # Ids are chunk indexes, so search results map straight back into
+        # the chunk store and re-ingesting upserts instead of duplicating
+        ids = [str(i) for i in range(len(self.chunk_store))]
+        self.vectorstore = Chroma.from_texts(
+            texts=self.chunk_store.texts(),
+            metadatas=self.chunk_store.metadatas(),
+            ids=ids,
+            embedding=self.embeddings,
             persist_directory=self.persist_directory
         )
+
+        # Drop entries left over from an earlier, larger corpus
+        stale_ids = set(self.vectorstore._collection.get(include=[])["ids"]) - set(ids)
+        if stale_ids:
+            self.vectorstore._collection.delete(ids=list(stale_ids))
         
-        print(f"Vector store created with {len(self.chunks)} embeddings")
+        print(f"Vector store created with {len(self.chunk_store)} embeddings")
     
     def _create_qa_chain(self):
         """
@@ -117,27 +159,46 @@ Helpful Answer (include source document):"""
 
         prompt = ChatPromptTemplate.from_template(prompt_template)
 
+        # Fast-path prompt: one chunk, short answer
+        fast_prompt_template = """Answer the customer's question in 1-3 sentences using only this documentation excerpt. If it doesn't contain the answer, say "I don't have that information in our documentation. Let me connect you with a human agent."
+
+Excerpt:
+{context}
+
+Question: {question}
+
+Answer:"""
+
+        fast_prompt = ChatPromptTemplate.from_template(fast_prompt_template)
+
         # Initialize LLM
         # LLMOps: Model version tracking, temperature settings
         llm = ChatOpenAI(
-            model_name="gpt-4o-mini",  # Cost-effective for support queries
+            model_name=LLM_MODEL,  # Cost-effective for support queries
             temperature=0.3,  # Lower = more factual, less creative
+            max_tokens=FULL_MAX_TOKENS,
             openai_api_key=os.getenv("OPENAI_API_KEY")
         )
-
-        # Create retriever
-        self.retriever = self.vectorstore.as_retriever(
-            search_kwargs={"k": 3}  # Return top 3 most relevant chunks
+        fast_llm = ChatOpenAI(
+            model_name=LLM_MODEL,
+            temperature=0,
+            max_tokens=FAST_MAX_TOKENS,  # Strict cap keeps the fast path fast
+            openai_api_key=os.getenv("OPENAI_API_KEY")
         )
 
-        # Create LCEL chain: retriever -> format context -> LLM -> parse output
-        def format_docs(docs):
-            return "\n\n".join(doc.page_content for doc in docs)
+        # Create retriever (returns top 3 most relevant chunks)
+        self.retriever = RunnableLambda(self._retrieve)
 
+        # Answer chains take already-retrieved context, so single and batch
+        # search can share them without retrieving twice. They return the
+        # raw message so token usage can be tracked per route.
+        self.answer_chain = prompt | llm
+        self.fast_chain = fast_prompt | fast_llm
+
+        # Create LCEL chain: retriever -> format context -> LLM -> parse output
         self.qa_chain = (
-            {"context": self.retriever | format_docs, "question": RunnablePassthrough()}
-            | prompt
-            | llm
+            {"context": self.retriever | self._format_docs, "question": RunnablePassthrough()}
+            | self.answer_chain
             | StrOutputParser()
         )
 
@@ -152,30 +213,20 @@ Helpful Answer (include source document):"""
             user_email: Optional user context
 
         Returns:
-            dict with answer and sources
+            dict with answer, sources and the generation route used
 
         LLMOps Practice: Query logging for model improvement
         """
         print(f"\n--- RAG Search ---")
         print(f"Query: {query}")
 
-        # Execute search - LCEL chain returns the answer directly
-        answer = self.qa_chain.invoke(query)
-
-        # Get source documents separately for citation
+        # Retrieve once and reuse the chunks for both generation and citation
         source_docs = self.retriever.invoke(query)
+        response = self._generate(query, source_docs)
+        answer = response["answer"]
+        sources = response["sources"]
 
-        # Extract unique source files
-        sources = list(set([doc.metadata.get("source", "Unknown") for doc in source_docs]))
-
-        # Format response
-        response = {
-            "answer": answer,
-            "sources": sources,
-            "num_sources": len(source_docs)
-        }
-
-        print(f"Answer generated from {len(source_docs)} sources")
+        print(f"Answer generated from {len(source_docs)} sources via {response['route']} route")
         print(f"--- End RAG Search ---\n")
 
         # LLMOps: Log this query for monitoring and improvement
@@ -184,6 +235,249 @@ Helpful Answer (include source document):"""
 
         return response
     
+    @staticmethod
+    def _format_docs(docs):
+        return "\n\n".join(doc.page_content for doc in docs)
+
+    def _generate(self, query, source_docs):
+        """
+        Generate an answer from already-retrieved chunks.
+
+        The router picks the cheapest route the retrieval scores and query
+        allow: an extractive quote, the fast single-chunk prompt, or the
+        full prompt over every chunk.
+
+        Returns:
+            dict with answer, sources, num_sources and route
+        """
+        start_time = time.time()
+        route = self.router.choose(query, source_docs)
+        answer = None
+        model = None
+        input_tokens = output_tokens = 0
+
+        if route == ROUTE_EXTRACTIVE:
+            # Chunks come back best-first
+            quote = extractive_answer(query, source_docs[0])
+            if quote:
+                source_name = os.path.basename(source_docs[0].metadata.get("source", "Unknown"))
+                answer = f"{quote}\n\n(From {source_name})"
+                sources = [source_docs[0].metadata.get("source", "Unknown")]
+            else:
+                route = ROUTE_FAST
+
+        if route == ROUTE_FAST:
+            answer, sources, input_tokens, output_tokens = self._invoke(self.fast_chain, query, source_docs[:1])
+            model = LLM_MODEL
+            if answer.strip().startswith(NO_ANSWER_PREFIX) and len(source_docs) > 1:
+                # The top chunk alone wasn't enough; don't give up before
+                # the full prompt has seen every retrieved chunk
+                self.router.record(
+                    route,
+                    latency_ms=(time.time() - start_time) * 1000,
+                    model=model,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    escalated=True
+                )
+                start_time = time.time()
+                route = ROUTE_FULL
+
+        if route == ROUTE_FULL:
+            answer, sources, input_tokens, output_tokens = self._invoke(self.answer_chain, query, source_docs)
+            model = LLM_MODEL
+
+        self.router.record(
+            route,
+            latency_ms=(time.time() - start_time) * 1000,
+            model=model,
+            input_tokens=input_tokens,
+            output_tokens=output_tokens
+        )
+
+        return {
+            "answer": answer,
+            "sources": sources,
+            "num_sources": len(source_docs),
+            "route": route
+        }
+
+    def _invoke(self, chain, query, context_docs):
+        """
+        Run an answer chain over the given chunks.
+
+        Returns:
+            (answer, unique source files, input tokens, output tokens)
+        """
+        context = self._format_docs(context_docs)
+        message = chain.invoke({"context": context, "question": query})
+        answer = message.content
+
+        # Prefer the API's token counts; estimate if it didn't report them
+        usage = getattr(message, "usage_metadata", None) or {}
+        input_tokens = usage.get("input_tokens") or estimate_tokens(context + query)
+        output_tokens = usage.get("output_tokens") or estimate_tokens(answer)
+
+        sources = list(set([doc.metadata.get("source", "Unknown") for doc in context_docs]))
+        return answer, sources, input_tokens, output_tokens
+
+    def _search_vectors(self, vectors):
+        """
+        Vector search for one or more query embeddings.
+
+        Only chunk ids and distances come back from Chroma; Documents are
+        materialized from the chunk store for just the top-k hits, with a
+        0-1 `relevance_score` in their metadata for the model router.
+
+        Returns:
+            list of Document lists (best first), one per vector
+        """
+        results = self.vectorstore._collection.query(
+            query_embeddings=vectors,
+            n_results=self.top_k,
+            include=["distances"]
+        )
+        docs_per_vector = []
+        for ids, distances in zip(results["ids"], results["distances"]):
+            docs = self.chunk_store.documents(int(chunk_id) for chunk_id in ids)
+            for doc, distance in zip(docs, distances):
+                # Chroma's default squared L2 on unit-length OpenAI embeddings
+                # is 2 - 2*cosine, so this recovers cosine similarity
+                doc.metadata["relevance_score"] = round(max(0.0, 1 - distance / 2), 4)
+            docs_per_vector.append(docs)
+        return docs_per_vector
+
+    def _retrieve(self, query):
+        """Retrieve the top-k chunks for a single query."""
+        return self._search_vectors([self.query_embeddings.embed_query(query)])[0]
+
+    def _retrieve_batch(self, queries):
+        """
+        Embed many queries in one request and run vector search for all of them.
+
+        Software Engineering: One embeddings call (cache misses only) and one
+        Chroma query per batch instead of one round-trip each per question
+
+        Returns:
+            list of Document lists, one per query
+        """
+        return self._search_vectors(self.query_embeddings.embed_queries(queries))
+
+    def search_batch(self, queries, batch_size=64, max_workers=8, skip_ids=None, slot=None):
+        """
+        Answer many questions, yielding results as they complete.
+
+        Queries are embedded and searched `batch_size` at a time; LLM
+        generation fans out over a bounded pool of `max_workers` threads.
+        Results are yielded in completion order, not input order.
+
+        Args:
+            queries: iterable of strings or dicts with "query" and optional "id"
+                (ids default to the item's position in the input)
+            batch_size: queries per embedding/vector search call
+            max_workers: concurrent LLM generations
+            skip_ids: ids already answered, e.g. when resuming a run
+            slot: optional zero-argument callable returning a context manager
+                held around each LLM generation, e.g. a scheduler slot so
+                batches share capacity with interactive traffic
+
+        Yields:
+            dict with id, query, answer, sources, num_sources and error
+            (error is None on success; failures, including malformed
+            items, never stop the batch)
+        """
+        # Ids are strings or integers; anything else can't have been answered
+        skip_ids = {i for i in (skip_ids or []) if self._valid_batch_id(i)}
+
+        def pending_items():
+            """Yield (id, query, error) with error set for malformed items."""
+            for position, item in enumerate(queries):
+                if isinstance(item, str):
+                    item = {"query": item}
+                if not isinstance(item, dict):
+                    yield position, None, "Item must be a string or an object with a query"
+                    continue
+                item_id = item.get("id", position)
+                if not self._valid_batch_id(item_id):
+                    yield position, item.get("query"), "id must be a string or an integer"
+                    continue
+                if item_id in skip_ids:
+                    continue
+                query = item.get("query")
+                if not isinstance(query, str):
+                    yield item_id, query, "query must be a string"
+                    continue
+                yield item_id, query, None
+
+        def failed(item_id, query, error):
+            return {
+                "id": item_id,
+                "query": query,
+                "answer": None,
+                "sources": [],
+                "num_sources": 0,
+                "route": None,
+                "error": str(error)
+            }
+
+        def generate(item_id, query, docs):
+            try:
+                with (slot or nullcontext)():
+                    result = self._generate(query, docs)
+            except Exception as e:
+                return failed(item_id, query, e)
+            return {"id": item_id, "query": query, **result, "error": None}
+
+        items = pending_items()
+        in_flight = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            while True:
+                batch = []
+                for item_id, query, error in items:
+                    if error:
+                        yield failed(item_id, query, error)
+                        continue
+                    batch.append((item_id, query))
+                    if len(batch) >= batch_size:
+                        break
+                if not batch:
+                    break
+
+                # Empty queries can't be embedded; report them, search the rest
+                searchable = []
+                for item_id, query in batch:
+                    if query.strip():
+                        searchable.append((item_id, query))
+                    else:
+                        yield failed(item_id, query, "Empty query")
+
+                try:
+                    docs_per_query = self._retrieve_batch([q for _, q in searchable]) if searchable else []
+                except Exception as e:
+                    print(f"Batch retrieval error: {str(e)}")
+                    for item_id, query in searchable:
+                        yield failed(item_id, query, e)
+                    continue
+
+                for (item_id, query), docs in zip(searchable, docs_per_query):
+                    in_flight.add(pool.submit(generate, item_id, query, docs))
+
+                # Backpressure: don't embed further ahead than the pool can answer
+                while len(in_flight) > max_workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while in_flight:
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    @staticmethod
+    def _valid_batch_id(item_id):
+        return isinstance(item_id, (str, int)) and not isinstance(item_id, bool)
+
     def _log_query(self, query, answer, sources):
         """
         Log queries for LLMOps monitoring.